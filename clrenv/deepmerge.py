@@ -1,22 +1,65 @@
-from collections import abc, deque
-from typing import Any, Mapping, MutableMapping
+from collections import abc
+from typing import Any, List, Mapping, MutableMapping
+
+# Types of immutable scalars which are never copied.
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
 
 
 def deepmerge(dst: MutableMapping[str, Any], src: Mapping[str, Any]):
     """Merges src into dst.
 
     If both source and dest values are Mappings merge them as well.
+
+    Containers from src are copied into dst rather than shared, see copy_containers.
+    src may therefore be read only and is never modified through dst.
     """
-    # Queue of (dict, dict) tuples to merge.
-    to_merge = deque([(dst, src)])
-
-    while to_merge:
-        _dst, _src = to_merge.pop()
-        for key, src_value in _src.items():
-            dst_value = _dst.get(key)
-            if isinstance(dst_value, abc.Mapping) and isinstance(
-                src_value, abc.Mapping
+    # Stacks of dicts to merge. Parallel lists avoid allocating a tuple per pair.
+    dst_stack: List[MutableMapping[str, Any]] = [dst]
+    src_stack: List[Mapping[str, Any]] = [src]
+
+    while dst_stack:
+        _dst = dst_stack.pop()
+        _src = src_stack.pop()
+        # Only keys present on both sides may need a nested merge. Usually the keys are
+        # mostly disjoint so the rest are copied over with a single update.
+        overlap = _src.keys() & _dst.keys()
+        if not overlap:
+            _dst.update(copy_containers(_src))
+            continue
+        for key in overlap:
+            dst_value = _dst[key]
+            src_value = _src[key]
+            # YAML only produces plain dicts, check for those before the slower
+            # isinstance check.
+            if (type(dst_value) is dict or isinstance(dst_value, abc.Mapping)) and (
+                type(src_value) is dict or isinstance(src_value, abc.Mapping)
             ):
-                to_merge.append((dst_value, src_value))  # type: ignore
+                dst_stack.append(dst_value)  # type: ignore
+                src_stack.append(src_value)
             else:
-                _dst[key] = src_value
+                _dst[key] = copy_containers(src_value)
+        _dst.update(
+            {
+                key: copy_containers(value)
+                for key, value in _src.items()
+                if key not in overlap
+            }
+        )
+
+
+def copy_containers(value: Any) -> Any:
+    """Returns a mutable copy of a nested value.
+
+    Mappings are copied as dicts and lists and tuples as lists. Much faster than
+    copy.deepcopy which also dispatches on every immutable scalar.
+    """
+    value_type = type(value)
+    if value_type in _SCALAR_TYPES:
+        return value
+    if value_type is dict or isinstance(value, abc.Mapping):
+        return {key: copy_containers(item) for key, item in value.items()}
+    if value_type is list or value_type is tuple:
+        return [copy_containers(item) for item in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
@@ -7,11 +7,12 @@ or attribute syntax.
 The environment is built from three sources (in order of priority):
 1) Runtime overrides.
 2) Environmental variables. Variables in the form of CLRENV__FOO__BAR=baz will cause
-   env.foo.bar==baz. These are evaluated at access time.
-   TODO(michael.cusack): Should these also be fixed on the state at first env usage?
-   Should we monitor and warn changes?
+   env.foo.bar==baz. These are snapshotted on first access and the snapshot is static
+   after that. Changes to CLRENV env vars, including adding or removing them, are
+   only picked up after env.refresh_env_vars() or env.reload().
+   TODO(michael.cusack): Should we monitor and warn changes?
 3) By reading a set of yaml files from disk as described in path.py. Files are read
-   lazily when the first attribute is referenced and never reloaded.
+   lazily when the first attribute is referenced and only reloaded by env.reload().
 
 # Runtime Overrides
 RootClrEnv.set_runtime_override(key_path, value) allows you to override values at
@@ -23,15 +24,18 @@ in test teardown.
 """
 import logging
 import os
+import re
+import sys
 import traceback
 from collections import abc
 from pathlib import Path
 from typing import (
+    Dict,
+    FrozenSet,
     Iterable,
     Iterator,
     List,
     Mapping,
-    MutableMapping,
     Optional,
     Sequence,
     Set,
@@ -39,6 +43,7 @@ from typing import (
     Union,
 )
 
+from .path import clear_cache as clear_path_cache
 from .path import environment_paths
 from .read import EnvReader
 from .types import LeafValue, NestedMapping, Secret, check_valid_leaf_value
@@ -46,13 +51,38 @@ from .types import LeafValue, NestedMapping, Secret, check_valid_leaf_value
 logger = logging.getLogger(__name__)
 
 DEBUG_MODE = os.environ.get("CLRENV_DEBUG", "").lower() in ("true", "1")
+# Number of stack frames logged for runtime overrides in debug mode.
+STACK_LIMIT = 20
 
 # Access to an attribute might return a primitive or if it is not a leaf node
 # another SubClrEnv.
 Value = Union[LeafValue, "SubClrEnv"]
+# Leaf values keyed by their full key path. env.a.b.c = 'd' ==> {('a', 'b', 'c'): 'd'}
+FlatEnv = Dict[Tuple[str, ...], LeafValue]
+# Every non leaf node keyed by its key path. ==> {(): {'a': {...}}, ('a',): {...}, ...}
+SubtreesByPath = Dict[Tuple[str, ...], NestedMapping]
+# Keys defined by env vars keyed by env var prefix.
+# CLRENV__A__B=c ==> {'CLRENV__': {'a'}, 'CLRENV__A__': {'b'}}
+EnvVarIndex = Dict[str, Set[str]]
+
+# Matches CLRENV env var names in a NUL delimited (and prefixed) list of names. NUL can
+# not be part of an env var name so it is a safe delimiter.
+_CLRENV_ENV_VAR_RE = re.compile("\0(CLRENV__[^\0]*)")
 
 
 class SubClrEnv(abc.MutableMapping):
+    # Nodes are created for every nested lookup, slots keep them small and fast.
+    __slots__ = (
+        "_cached_env",
+        "_parent",
+        "_key_path",
+        "_root",
+        "_env_var_prefix",
+        "_child_key_paths",
+        "_child_cache",
+        "_cached_sub_keys",
+    )
+
     def __init__(self, parent: "SubClrEnv", next_key: str):
         # The RootClrEnv class omits these, but SubClrEnv needs them.
         assert parent and next_key
@@ -61,6 +91,15 @@ class SubClrEnv(abc.MutableMapping):
         self._parent: SubClrEnv = parent
         self._key_path: Tuple[str, ...] = parent._sub_key_path(next_key)
         self._root: RootClrEnv = parent._root
+        # Key paths of children, see _sub_key_path.
+        self._child_key_paths: Dict[str, Tuple[str, ...]] = {}
+        # Child nodes that have been accessed, see __getitem__.
+        self._child_cache: Dict[str, SubClrEnv] = {}
+        # Root generation and sub keys when they were last computed.
+        self._cached_sub_keys: Optional[Tuple[int, FrozenSet[str]]] = None
+        # The key path is fixed so the env var prefix only needs to be built once. It
+        # extends the parent's prefix, equal to _make_env_var_name(as_prefix=True).
+        self._env_var_prefix: str = parent._env_var_prefix + next_key.upper() + "__"
 
     def __getitem__(self, key: str) -> Value:
         """Allows access with item getter, like a Mapping."""
@@ -73,9 +112,11 @@ class SubClrEnv(abc.MutableMapping):
             # There will never be explicit Nones.
             raise KeyError(f"Unknown key in {self}: {key}")
 
-        if isinstance(value, abc.Mapping):
+        # Plain dicts are by far the most common mapping, check for them before the
+        # slower isinstance check.
+        if type(value) is dict or isinstance(value, abc.Mapping):
             # Nest to allow deeper lookups.
-            return SubClrEnv(self, key)
+            return self._child(key)
 
         # Return the actual value.
         return value
@@ -83,8 +124,14 @@ class SubClrEnv(abc.MutableMapping):
     def __getattr__(self, key: str) -> Value:
         """Allows access as attributes."""
         if key.startswith("_"):
-            # This is raise an exception.
-            object.__getattribute__(self, key)
+            # __getattr__ is only called once normal lookup failed. Internal fields are
+            # slots or properties. A property that raised AttributeError also ends up
+            # here, run it again to surface its actual error.
+            if hasattr(type(self), key):
+                object.__getattribute__(self, key)
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {key!r}"
+            )
         try:
             return self[key]
         except KeyError as e:
@@ -103,6 +150,16 @@ class SubClrEnv(abc.MutableMapping):
     def __delitem__(self, key: str):
         """Only support deleting runtime overrides."""
         del self._root._runtime_overrides[self._key_path][key]
+        self._root._generation += 1
+
+    def __contains__(self, key: object) -> bool:
+        """Agrees with __getitem__ without raising and formatting a KeyError, which
+        includes the repr of this node, for unknown keys."""
+        if not isinstance(key, str) or key.startswith("_"):
+            return False
+        # Most keys are found in the cached sub keys. Others may still evaluate, e.g.
+        # env var keys are matched case insensitively.
+        return key in self._sub_keys or self._evaluate_key(key) is not None
 
     def __iter__(self) -> Iterator[str]:
         return iter(self._sub_keys)
@@ -115,43 +172,64 @@ class SubClrEnv(abc.MutableMapping):
         values = {
             key: repr(self._env.get(key))
             if isinstance(self._env.get(key), Secret)
-            else SubClrEnv(self, key).__repr__(include_prefix=False)
+            else self._child(key).__repr__(include_prefix=False)
             if isinstance(self._env.get(key), abc.Mapping)
             else self[key]
             for key in self
         }
         return f"{prefix}{values}"
 
+    def _child(self, key: str) -> "SubClrEnv":
+        """Returns the child node for the given key.
+
+        Nodes only hold their key path and lazily evaluate everything else so they can
+        be reused for repeated lookups. Callers must check that the key is not a leaf,
+        for example because it was overridden."""
+        child = self._child_cache.get(key)
+        if child is None:
+            child = self._child_cache[key] = SubClrEnv(self, key)
+        return child
+
     def _make_env(self) -> NestedMapping:
         """Creates an env map relative to this path."""
-        # Get subtree of parent env.
-        return self._parent._env.get(self._key_path[-1], {})  # type: ignore
+        # Get subtree directly from the root instead of walking down the parents.
+        return self._root._subtrees.get(self._key_path, {})
 
     @property
     def _env(self) -> NestedMapping:
         """Returns the env map relative to this path.
 
         Using this function allows lazy evaluation."""
-        if not self._cached_env:
+        if self._cached_env is None:
             self._cached_env = self._make_env()
         return self._cached_env
 
     @property
-    def _sub_keys(self) -> Set[str]:
-        """Returns the set of all valid keys under this node."""
-        # Keys in the merged env.
-        subkeys = set(self._env.keys())
-
-        # Keys in runtime overrides
-        if self._key_path in self._root._runtime_overrides:
-            subkeys.update(self._root._runtime_overrides[self._key_path])
-
-        # Keys defined in environmental vars.
-        env_var_prefix = self._make_env_var_name(as_prefix=True)
-        for env_var in os.environ:
-            if env_var.startswith(env_var_prefix):
-                env_var = env_var[len(env_var_prefix) :]
-                subkeys.add(env_var.split("__")[0].lower())
+    def _sub_keys(self) -> FrozenSet[str]:
+        """Returns the set of all valid keys under this node.
+
+        The result is cached until the root's generation changes."""
+        # Bind attributes to locals, this is on the hot path.
+        root = self._root
+        key_path = self._key_path
+        cached_sub_keys = self._cached_sub_keys
+
+        # Accessing the env var index first updates the generation if the env vars are
+        # snapshotted.
+        env_var_index = root._env_var_index
+        generation = root._generation
+        if cached_sub_keys and cached_sub_keys[0] == generation:
+            return cached_sub_keys[1]
+
+        subkeys = frozenset().union(
+            # Keys in the merged env.
+            root._subtrees.get(key_path, ()),
+            # Keys in runtime overrides
+            root._runtime_overrides.get(key_path, ()),
+            # Keys defined in environmental vars.
+            env_var_index.get(self._env_var_prefix, ()),
+        )
+        self._cached_sub_keys = (generation, subkeys)
         return subkeys
 
     def _evaluate_key(self, key: str) -> Union[LeafValue, Mapping, None]:
@@ -170,22 +248,25 @@ class SubClrEnv(abc.MutableMapping):
         values. Any nulls in the yaml files are coerced to empty strings when read.
         Runtime overrides are not allowed to set None.
         """
-        key_path = self._sub_key_path(key)
+        # Bind attributes to locals, this is the hottest path.
+        root = self._root
 
-        # Check for runtime overrides.
-        if self._key_path in self._root._runtime_overrides:
-            if key in self._root._runtime_overrides[self._key_path]:
-                return self._root._runtime_overrides[self._key_path][key]
+        # Check for runtime overrides. These are keyed by the path of this node so the
+        # key path of the child is not needed.
+        overrides = root._runtime_overrides.get(self._key_path)
+        if overrides:
+            override = overrides.get(key)
+            if override is not None:
+                return override
 
         # Check for env var override.
-        env_var_name = self._make_env_var_name(key_path=key_path)
-        if env_var_name in os.environ:
-            env_var_value = os.environ[env_var_name]
+        env_var_value = root._env_var_snapshot.get(self._env_var_prefix + key.upper())
+        if env_var_value is not None:
             # TODO(michael.cusack) cast type?
             return env_var_value
 
         # Get value from the merged env.
-        value = self._env.get(key)
+        value = root._flat.get(self._sub_key_path(key))
 
         # If the value is absent from all three sources but the key does exist in
         # subkeys it means this is an intermediate node of a value set via env vars.
@@ -194,53 +275,157 @@ class SubClrEnv(abc.MutableMapping):
         if value is None and key in self._sub_keys:
             return {}
 
-        if isinstance(value, Secret):
-            return value.value
-
         return value
 
     def _sub_key_path(self, key: str) -> Tuple[str, ...]:
-        """Returns an attribute path with the given key appended."""
-        return self._key_path + (key,)
+        """Returns an attribute path with the given key appended.
+
+        Paths that exist in the env are interned so repeated lookups do not allocate.
+        Others are not kept, probing unknown keys must not grow the caches."""
+        key_path = self._child_key_paths.get(key)
+        if key_path is None:
+            key_path = self._key_path + (key,)
+            interned = self._root._interned_key_paths.get(key_path)
+            if interned is not None:
+                key_path = self._child_key_paths[key] = interned
+        return key_path
 
     def _make_env_var_name(
         self, key_path: Optional[Iterable[str]] = None, as_prefix: bool = False
     ) -> str:
         """Returns the env var name that can be used to set the given attribute path."""
         if key_path is None:
-            key_path = self._key_path
-        key_path = list(key_path)
-        key_path.insert(0, "CLRENV")
-        if as_prefix:
-            key_path.append("")
-        return "__".join(key_path).upper()
+            # The prefix of this node is computed once, when it is created.
+            return self._env_var_prefix if as_prefix else self._env_var_prefix[:-2]
+        # Join first and upper case the whole name once rather than per segment.
+        name = "__".join(("CLRENV", *key_path)).upper()
+        return name + "__" if as_prefix else name
 
 
 class RootClrEnv(SubClrEnv):
     """Special case of SubClrEnv for the root node."""
 
+    __slots__ = (
+        "_environment_paths",
+        "_cached_flat",
+        "_cached_subtrees",
+        "_cached_env_var_snapshot",
+        "_cached_env_var_index",
+        "_interned_key_paths",
+        "_runtime_overrides",
+        "_generation",
+    )
+
     def __init__(self, paths: Optional[List[Path]] = None):
         self._environment_paths = paths
         self._cached_env: Optional[NestedMapping] = None
+        self._cached_flat: Optional[FlatEnv] = None
+        self._cached_subtrees: Optional[SubtreesByPath] = None
+        # Taken on first access, see refresh_env_vars.
+        self._cached_env_var_snapshot: Optional[Dict[str, str]] = None
+        self._cached_env_var_index: EnvVarIndex = {}
         self._root: RootClrEnv = self
         self._parent: RootClrEnv = self
         self._key_path: Tuple[str, ...] = tuple()
-
-        # Runtime overrides for all key paths are stored in the root node. The first
-        # key is the parent key path and the second key is the leaf key. This allows
-        # efficent lookup for subkeys.
+        self._env_var_prefix: str = "CLRENV__"
+        self._child_key_paths: Dict[str, Tuple[str, ...]] = {}
+        self._child_cache: Dict[str, SubClrEnv] = {}
+        self._cached_sub_keys: Optional[Tuple[int, FrozenSet[str]]] = None
+        # Incremented whenever runtime overrides or env vars change. Used to invalidate
+        # cached sub keys.
+        self._generation = 0
+        # Canonical instance of every key path in use. Equal key paths are then also
+        # identical which makes dict lookups keyed by them cheaper.
+        self._interned_key_paths: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+        # Runtime overrides for all key paths are stored in the root node keyed by the
+        # key path of their parent and then by key. This allows efficent lookup for
+        # subkeys and lookup of values without building the full key path.
         # env.a.b.c = 'd' ==> _runtime_overrides = {('a', 'b'): {'c': 'd'}}
-        self._runtime_overrides: MutableMapping[
-            Tuple[str, ...], MutableMapping[str, LeafValue]
-        ] = {}
+        self._runtime_overrides: Dict[Tuple[str, ...], Dict[str, LeafValue]] = {}
 
     def _make_env(self) -> NestedMapping:
         # Lazily read the environment from disk.
         return EnvReader(self._environment_paths or environment_paths()).read()
 
+    def _flatten_env(self):
+        """Flattens the merged env and interns all of its key paths.
+
+        Secrets never change once read so they are unwrapped here rather than on every
+        access. The nested env keeps the Secrets so that repr does not leak them."""
+        flat, subtrees = flatten(self._env)
+        self._cached_flat = {
+            self._intern(path): value.value if isinstance(value, Secret) else value
+            for path, value in flat.items()
+        }
+        self._cached_subtrees = {
+            self._intern(path): subtree for path, subtree in subtrees.items()
+        }
+
+    @property
+    def _flat(self) -> FlatEnv:
+        """Returns the leaf values of the merged env keyed by their key path.
+
+        Looking up a value is a single dict access no matter how deeply it is nested."""
+        if self._cached_flat is None:
+            self._flatten_env()
+        return self._cached_flat  # type: ignore
+
+    @property
+    def _subtrees(self) -> SubtreesByPath:
+        """Returns every non leaf node of the merged env keyed by its key path."""
+        if self._cached_subtrees is None:
+            self._flatten_env()
+        return self._cached_subtrees  # type: ignore
+
+    def _intern(self, key_path: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Returns the canonical instance of the given key path."""
+        return self._interned_key_paths.setdefault(key_path, key_path)
+
+    @property
+    def _env_var_snapshot(self) -> Dict[str, str]:
+        """Returns the snapshot of the CLRENV env vars keyed by name."""
+        if self._cached_env_var_snapshot is None:
+            self.refresh_env_vars()
+        return self._cached_env_var_snapshot  # type: ignore
+
+    @property
+    def _env_var_index(self) -> EnvVarIndex:
+        """Returns the keys defined by CLRENV env vars keyed by env var prefix."""
+        if self._cached_env_var_snapshot is None:
+            self.refresh_env_vars()
+        return self._cached_env_var_index
+
+    def refresh_env_vars(self):
+        """Snapshots the CLRENV env vars again.
+
+        Scanning os.environ is expensive so it is only done on first access and when
+        this is called. Call it after adding, removing or changing CLRENV env vars at
+        runtime."""
+        self._cached_env_var_snapshot = snapshot_env_vars(os.environ)
+        self._cached_env_var_index = index_env_vars(self._cached_env_var_snapshot)
+        self._generation += 1
+
+    def reload(self):
+        """Discards the merged env so that it is read from disk again on next access.
+
+        Environment files are looked up again and CLRENV env vars are snapshotted
+        again too. Runtime overrides are kept."""
+        clear_path_cache()
+        self._cached_env_var_snapshot = None
+        self._cached_env = None
+        self._cached_flat = None
+        self._cached_subtrees = None
+        # Cached nodes hold on to subtrees of the discarded env.
+        self._child_cache.clear()
+        self._child_key_paths.clear()
+        self._interned_key_paths.clear()
+        self._generation += 1
+
     def clear_runtime_overrides(self):
         """Clear all runtime overrides."""
         self._runtime_overrides.clear()
+        self._generation += 1
 
     def set_runtime_override(
         self, key_path: Union[str, Sequence[str]], value: LeafValue
@@ -259,22 +444,72 @@ class RootClrEnv(SubClrEnv):
         if isinstance(key_path, str):
             key_path = key_path.split(".")
 
-        # Check that the key already exists.
+        # Check that the key already exists. Each node is only evaluated once, and
+        # intermediate nodes come from the child caches rather than being rebuilt.
         parent: Union[SubClrEnv, LeafValue] = self
         for name in key_path:
-            assert isinstance(parent, Mapping)
-            assert name in parent, f"{name, parent}"
-            parent = parent[name]
+            assert isinstance(parent, SubClrEnv)
+            try:
+                parent = parent[name]
+            except KeyError:
+                raise AssertionError(f"{name, parent}")
 
         # Ideally we wouldn't be overriding global state like this at all, but at least
         # make it loud.
-        logger.warning(f"Manually overriding env.{'.'.join(key_path)} to {value}.")
-        if DEBUG_MODE:
-            # Get stack and remove this frame.
-            tb = traceback.extract_stack()[:-1]
-            logger.warning("".join(traceback.format_list(tb)))
-
-        parents = tuple(key_path[:-1])
-        if parents not in self._root._runtime_overrides:
-            self._root._runtime_overrides[parents] = {}
-        self._root._runtime_overrides[parents][key_path[-1]] = value
+        # Nothing is formatted unless the warning is actually going to be logged.
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning(
+                "Manually overriding env.%s to %s.", ".".join(key_path), value
+            )
+            if DEBUG_MODE:
+                # Get the innermost frames of the stack, excluding this frame. Deeper
+                # frames rarely help and walking them all is expensive.
+                tb = traceback.format_stack(sys._getframe(1), limit=STACK_LIMIT)
+                logger.warning("".join(tb))
+
+        parent_key_path = self._intern(tuple(key_path[:-1]))
+        self._runtime_overrides.setdefault(parent_key_path, {})[key_path[-1]] = value
+        self._generation += 1
+
+
+def flatten(env: NestedMapping) -> Tuple[FlatEnv, SubtreesByPath]:
+    """Flattens the nested env into its leaf values and its non leaf nodes, both keyed
+    by key path."""
+    flat: FlatEnv = {}
+    subtrees: SubtreesByPath = {}
+    # Stack of (key path, mapping) tuples to flatten.
+    to_flatten: List[Tuple[Tuple[str, ...], NestedMapping]] = [(tuple(), env)]
+
+    while to_flatten:
+        key_path, mapping = to_flatten.pop()
+        subtrees[key_path] = mapping
+        for key, value in mapping.items():
+            if type(value) is dict or isinstance(value, abc.Mapping):
+                to_flatten.append((key_path + (key,), value))
+            else:
+                flat[key_path + (key,)] = value
+    return flat, subtrees
+
+
+def snapshot_env_vars(environ: Mapping[str, str]) -> Dict[str, str]:
+    """Returns a copy of the CLRENV env vars in the given environ."""
+    # A single regex scan over all names is faster than checking each name in Python.
+    return {
+        env_var: environ[env_var]
+        for env_var in _CLRENV_ENV_VAR_RE.findall("\0" + "\0".join(environ))
+    }
+
+
+def index_env_vars(env_vars: Iterable[str]) -> EnvVarIndex:
+    """Indexes the keys defined by CLRENV env vars by the env var prefix of their parent.
+
+    env_vars must only contain CLRENV env var names, like a snapshot_env_vars result.
+    Equivalent to, but much faster than, scanning for env vars starting with a given
+    prefix every time the keys of a node are needed."""
+    index: EnvVarIndex = {}
+    for env_var in env_vars:
+        prefix = "CLRENV__"
+        for segment in env_var[8:].split("__"):
+            index.setdefault(prefix, set()).add(segment.lower())
+            prefix += segment + "__"
+    return index
@@ -14,8 +14,11 @@ Values in overlay files take precedence over values in the base file and mask it
 values. Note that this is a different mechanism from the base/"mode" sections in each
 file which also overlay values. See a full explanation in the docs for EnvReader#read.
 """
+import functools
 import logging
-from os import environ
+import os
+import stat
+from os import environ, getcwd
 from pathlib import Path
 from typing import Iterable, List, Optional, Tuple
 
@@ -31,13 +34,37 @@ def environment_paths() -> Tuple[Path, ...]:
     not return an empty list. All returned path are guaranteed to exist.
 
     Raises an exception if the base environment file can not be found.
+
+    Results are cached for the current working directory and values of CLRENV_PATH and
+    CLRENV_OVERLAY_PATH. Cached paths are checked to still exist, call clear_cache if
+    files are created.
     """
+    args = (getcwd(), environ.get("CLRENV_PATH"), environ.get("CLRENV_OVERLAY_PATH"))
+    result = _environment_paths(*args)
+    if not all(_is_file(path) for path in result):
+        # A file was deleted since the result was cached.
+        clear_cache()
+        result = _environment_paths(*args)
+    return result
+
+
+def clear_cache():
+    """Clears cached environment paths."""
+    _environment_paths.cache_clear()
+    _find_in_cwd_or_parents.cache_clear()
+
+
+@functools.lru_cache(maxsize=8)
+def _environment_paths(
+    cwd: str, clrenv_path: Optional[str], clrenv_overlay_path: Optional[str]
+) -> Tuple[Path, ...]:
+    """Implements environment_paths."""
     result: List[Path] = []
-    result.extend(_resolve_paths(environ.get("CLRENV_OVERLAY_PATH")))
-    base_path = _resolve_path(environ.get("CLRENV_PATH"))
+    result.extend(_resolve_paths(clrenv_overlay_path))
+    base_path = _resolve_path(clrenv_path)
     if not base_path:
-        base_path = _find_in_cwd_or_parents("environment.yaml")
-    if not base_path or not base_path.is_file():
+        base_path = _find_in_cwd_or_parents("environment.yaml", cwd)
+    if not base_path or not _is_file(base_path):
         raise ValueError(
             f"Base environment file (CLRENV_PATH) could not be located. {base_path if base_path else ''}"
         )
@@ -61,17 +88,29 @@ def _resolve_paths(paths: Optional[str]) -> Iterable[Path]:
     result = []
     for path in paths.split(":") if paths else []:
         resolved = _resolve_path(path)
-        if resolved and resolved.is_file():
+        if resolved and _is_file(resolved):
             result.append(resolved)
         elif DEBUG_MODE:
             logging.warning(f'Could not find "{path}" {resolved}, ignoring it.')
     return result
 
 
-def _find_in_cwd_or_parents(name: str) -> Optional[Path]:
-    """Finds a file with the given name starting in the cwd and working up to root."""
-    for parent in (Path().absolute() / name).parents:
-        path = parent / name
-        if path.is_file():
+@functools.lru_cache(maxsize=8)
+def _find_in_cwd_or_parents(name: str, cwd: str) -> Optional[Path]:
+    """Finds a file with the given name starting in the cwd and working up to root.
+
+    Results are cached so the walk, a stat per directory, is done once per cwd."""
+    start = Path(cwd)
+    for directory in (start, *start.parents):
+        path = directory / name
+        if _is_file(path):
             return path
     return None
+
+
+def _is_file(path: Path) -> bool:
+    """Equivalent to path.is_file() with a single os.stat and less overhead."""
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except (OSError, ValueError):
+        return False
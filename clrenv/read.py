@@ -1,28 +1,39 @@
 """
 Reads clrenv environment files.
 """
-import yaml
-
-try:
-    # If available, use the C bindings for far, far faster loading
-    # See: https://pyyaml.org/wiki/PyYAMLDocumentation
-    from yaml import CSafeLoader as SafeLoader
-except ImportError:
-    # If the C bindings aren't available, fall back to the "much slower" Python bindings
-    from yaml import SafeLoader  # type: ignore
-
+import functools
+import hashlib
 import logging
 import os
-from collections import abc, deque
+import pickle
+import time
+from collections import abc
 from pathlib import Path
-from typing import Any, Deque, Iterable, Mapping, Optional, Tuple, Union
-
-import boto3
-from botocore.exceptions import EndpointConnectionError  # type: ignore
-
-from .deepmerge import deepmerge
+from types import MappingProxyType
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from .deepmerge import copy_containers, deepmerge
 from .path import environment_paths
-from .types import MutableNestedMapping, NestedMapping, Secret, check_valid_leaf_value
+from .types import (
+    PRIMITIVE_TYPES,
+    MutableNestedMapping,
+    NestedMapping,
+    Secret,
+    check_valid_leaf_value,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -34,11 +45,34 @@ logger = logging.getLogger(__name__)
 OFFLINE_PARAMETER_FLAG = "CLRENV_OFFLINE_DEV"
 OFFLINE_PARAMETER_VALUE = "CLRENV_OFFLINE_PLACEHOLDER"
 
+# Directory to cache merged environment files in, disabled if unset.
+CACHE_DIR_FLAG = "CLRENV_CACHE_DIR"
+# Seconds after which cache files are removed, see _remove_stale_cache_files.
+CACHE_MAX_AGE = 7 * 24 * 60 * 60
+
+# Names of the EnvReader methods that evaluate values tagged as "^<tag> <name>".
+SECRET_EVALUATORS = {
+    # Substitute from clrypt keyfile.
+    "keyfile": "evaluate_clrypt_key",
+    # Substitute from aws ssm parameter store.
+    "parameter": "evaluate_ssm_parameter",
+}
+
+# Maximum number of names accepted by a single ssm GetParameters call.
+SSM_BATCH_SIZE = 10
+SSM_ACCESS_DENIED = ("AccessDeniedException", "AccessDenied")
+
 
 class EnvReader:
     def __init__(self, environment_paths: Iterable[Path]):
         self.environment_paths: Tuple[Path, ...] = tuple(environment_paths)
+        # Paths are in decending precedence, merging is done in reverse.
+        self._merge_order: Tuple[Path, ...] = self.environment_paths[::-1]
         self.mode: Optional[str] = os.environ.get("CLRENV_MODE")
+        # Values of ssm parameters that have been fetched, keyed by name.
+        self.ssm_parameters: Dict[str, str] = {}
+        # Names of ssm parameters that do not exist.
+        self.invalid_ssm_parameters: Set[str] = set()
 
     def read(self) -> NestedMapping:
         """Reads, merges and post-processes environment from disk.
@@ -56,16 +90,86 @@ class EnvReader:
         4) mode1 section of file2 (optional)
         5) base section of file1 (required)
         6) mode1 section of file1 (optional)
+
+        If CLRENV_CACHE_DIR is set the merged files are cached there, see
+        read_merged_cached.
+        """
+        result = self.read_merged_cached()
+
+        # Leaves referencing ssm parameters. These are post processed last so that all
+        # parameters can be fetched in batches.
+        parameter_leaves: List[Tuple[MutableNestedMapping, str, str]] = []
+        self.postprocess(result, parameter_leaves)
+
+        self.fetch_ssm_parameters(
+            os.path.expandvars(value[11:]) for _, _, value in parameter_leaves
+        )
+        for mapping, key, value in parameter_leaves:
+            mapping[key] = self.postprocess_str(value)
+
+        return result
+
+    def read_merged_cached(self) -> MutableNestedMapping:
+        """Returns the merged environment files, before post processing.
+
+        If CLRENV_CACHE_DIR is set the result is pickled there, keyed by the paths,
+        modification times and sizes of the files and CLRENV_MODE. Other processes
+        reading the same unchanged files then skip parsing them. Only files and
+        directories trusted to be written by the current user must be used since
+        pickles can execute code when loaded. Values are cached before post
+        processing so env vars, secrets and parameters are always evaluated again.
         """
+        cache_dir = os.environ.get(CACHE_DIR_FLAG)
+        if not cache_dir:
+            return self.read_merged()
+
+        cache_path = Path(cache_dir) / f"{self.fingerprint()}.pickle"
+        try:
+            with open(cache_path, "rb") as cache_file:
+                return pickle.load(cache_file)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logger.warning(f"Ignoring unreadable clrenv cache file {cache_path}.")
+
+        result = self.read_merged()
+        # Write to a temporary file first so other processes never see a partial
+        # cache file.
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as cache_file:
+                pickle.dump(result, cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except Exception:
+            logger.warning(f"Could not write clrenv cache file {cache_path}.")
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+        else:
+            _remove_stale_cache_files(cache_path.parent)
+        return result
 
+    def fingerprint(self) -> str:
+        """Returns a key which changes whenever the result of read_merged may."""
+        # Pickled caches from other clrenv code may not be compatible.
+        key = [_code_version(), self.mode]
+        for path in self.environment_paths:
+            stat = path.stat()
+            key.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+        return hashlib.sha256(repr(key).encode()).hexdigest()
+
+    def read_merged(self) -> MutableNestedMapping:
+        """Reads and merges the environment files, see read."""
         # Whether a section for the specified mode has been read.
         mode_read = False
         # The merged config.
         result: MutableNestedMapping = {}
 
-        # Paths are in decending precedence so loop over in reverse for merging.
-        for config_path in self.environment_paths[::-1]:
-            config: Mapping[str, Any] = safe_load(config_path.read_text())
+        for config_path in self._merge_order:
+            # The cached parse is shared and read only, deepmerge copies what it merges.
+            config: Mapping[str, Any] = _load_file_shared(config_path)
             # safe_load will return None if the file is empty
             if not config:
                 continue
@@ -84,89 +188,360 @@ class EnvReader:
                 f"CLRENV_MODE set to {self.mode}, but no corresponding section found in any environment file."
             )
 
-        # Post process values. Breadth-first search.
-        postprocess_queue: Deque[Tuple[str, MutableNestedMapping]] = deque()
-        postprocess_queue.append(("", result))
-        while postprocess_queue:
-            key_prefix, mapping = postprocess_queue.pop()
-            for key, value in mapping.items():
-                # Disallow non string keys
-                if not isinstance(key, str):
-                    raise ValueError(f"Only string keys are allowed: {key_prefix}{key}")
-                if key.startswith("_"):
-                    raise ValueError(f"Keys can not start with _: {key_prefix}{key}")
-                if isinstance(value, abc.Mapping):
-                    # Add to queue for post processing.
-                    postprocess_queue.append((f"{key_prefix}{key}.", value))
-                elif value is None:
-                    # Coerce Nones to empty strings.
-                    mapping[key] = ""  # type: ignore
-                elif isinstance(value, str):
-                    mapping[key] = self.postprocess_str(value)
-                else:
-                    check_valid_leaf_value(key_prefix + key, value)
-
         return result
 
+    def postprocess(
+        self,
+        mapping: MutableMapping[str, Any],
+        parameter_leaves: List[Tuple[MutableNestedMapping, str, str]],
+        parent_keys: Tuple[str, ...] = (),
+    ):
+        """Post processes all values of the mapping in place, recursing into nested
+        mappings.
+
+        String values referencing ssm parameters are appended to parameter_leaves
+        instead of being evaluated."""
+        postprocess_str = self.postprocess_str
+        for key, value in mapping.items():
+            # Disallow non string keys
+            if not isinstance(key, str):
+                raise ValueError(
+                    f"Only string keys are allowed: {_dotted(parent_keys, key)}"
+                )
+            if key.startswith("_"):
+                raise ValueError(
+                    f"Keys can not start with _: {_dotted(parent_keys, key)}"
+                )
+            # Check exact types first, yaml only creates these. Comparing types is
+            # much cheaper than isinstance, especially against abc.Mapping.
+            value_type = type(value)
+            if value_type is str:
+                if value.startswith("^parameter "):
+                    parameter_leaves.append((mapping, key, value))
+                else:
+                    mapping[key] = postprocess_str(value)
+            elif value_type is dict:
+                self.postprocess(value, parameter_leaves, parent_keys + (key,))
+            elif value is None:
+                # Coerce Nones to empty strings.
+                mapping[key] = ""
+            elif value_type in PRIMITIVE_TYPES:
+                continue
+            elif isinstance(value, abc.Mapping):
+                self.postprocess(
+                    value, parameter_leaves, parent_keys + (key,)  # type: ignore
+                )
+            elif isinstance(value, str):
+                mapping[key] = postprocess_str(value)
+            else:
+                check_valid_leaf_value(_dotted(parent_keys, key), value)
+
     def postprocess_str(self, value: str) -> Union[str, Secret]:
         """Post process string values."""
         # Expand environmental variables in the form of $FOO or ${FOO}.
-        value = os.path.expandvars(value)
+        if "$" in value:
+            value = os.path.expandvars(value)
+        # Most values are plain strings, dispatch on the first character once rather
+        # than checking every prefix.
+        first = value[:1]
         # If value is a path starting with ~, expand.
-        if value.startswith("~"):
-            return os.path.expanduser(value)
-        # Substitute from clrypt keyfile.
-        elif value.startswith("^keyfile "):
-            return Secret(source=value, value=self.evaluate_clrypt_key(value[9:]))
-        # Substitute from aws ssm parameter store.
-        elif value.startswith("^parameter "):
-            return Secret(source=value, value=self.evaluate_ssm_parameter(value[11:]))
+        if first == "~":
+            return _expanduser(value, os.environ.get("HOME"))
+        elif first == "^":
+            # Substitute from a secret store, looking up the tag once.
+            tag, sep, name = value[1:].partition(" ")
+            evaluator = SECRET_EVALUATORS.get(tag) if sep else None
+            if evaluator:
+                return Secret(source=value, value=getattr(self, evaluator)(name))
 
         return value
 
     def evaluate_clrypt_key(self, name: str) -> str:
         """Returns a value from clrypt."""
         if not hasattr(self, "clrypt_keyfile"):
-            # Not all environments use clrypt, delay import until it is needed.
-            logger.info("Loading clrypt for clrenv")
-            import clrypt
-
-            self.clrypt_keyfile = clrypt.read_file_as_dict("keys", "keys")
+            self.clrypt_keyfile = _read_clrypt_file("keys", "keys")
 
         return str(self.clrypt_keyfile.get(name, ""))
 
+    def fetch_ssm_parameters(self, names: Iterable[str]):
+        """Fetches values from aws ssm parameter store in batches.
+
+        Fetched values are used by evaluate_ssm_parameter, saving a round trip per
+        parameter. Parameters reported as invalid are remembered so that
+        evaluate_ssm_parameter raises for them without another round trip.
+
+        GetParameters is a separate IAM action from GetParameter. If it is denied
+        nothing is prefetched and evaluate_ssm_parameter fetches each parameter.
+        """
+        if os.environ.get(OFFLINE_PARAMETER_FLAG):
+            return
+        # Unique names, in order.
+        to_fetch = [
+            name for name in dict.fromkeys(names) if name not in self.ssm_parameters
+        ]
+        if not to_fetch:
+            return
+
+        self.load_ssm_client()
+        from botocore.exceptions import (  # type: ignore
+            ClientError,
+            EndpointConnectionError,
+        )
+
+        for i in range(0, len(to_fetch), SSM_BATCH_SIZE):
+            batch = to_fetch[i : i + SSM_BATCH_SIZE]
+            try:
+                response = self.ssm_client.get_parameters(
+                    Names=batch, WithDecryption=True
+                )
+            except EndpointConnectionError:
+                _log_ssm_connection_error()
+                raise
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in SSM_ACCESS_DENIED:
+                    raise
+                logger.info("Not allowed to batch SSM parameters, fetching each.")
+                return
+            for parameter in response["Parameters"]:
+                # Names are returned without the :version or :label selector that was
+                # requested, and by name when an ARN was requested.
+                selector = parameter.get("Selector", "")
+                for name in (
+                    parameter["Name"] + selector,
+                    parameter.get("ARN", "") + selector,
+                ):
+                    if name in batch:
+                        self.ssm_parameters[name] = str(parameter["Value"])
+            self.invalid_ssm_parameters.update(response.get("InvalidParameters", ()))
+
     def evaluate_ssm_parameter(self, name: str) -> str:
         """Returns a value from aws ssm parameter store."""
         if os.environ.get(OFFLINE_PARAMETER_FLAG):
             logger.warning(f"Offline, using placeholder value for {name}.")
             return OFFLINE_PARAMETER_VALUE
 
-        if not hasattr(self, "ssm_client"):
-            # Not all environments use ssm, delay import until it is needed.
-            logger.info("Loading SSM ParameterStore for clrenv")
-            self.ssm_client = boto3.client("ssm")
+        if name in self.ssm_parameters:
+            return self.ssm_parameters[name]
+
+        self.load_ssm_client()
+        if name in self.invalid_ssm_parameters:
+            logger.error(f"Could not find {name} in Parameter Store.")
+            raise self.ssm_client.exceptions.ParameterNotFound(
+                error_response={
+                    "Error": {"Code": "ParameterNotFound", "Message": name}
+                },
+                operation_name="GetParameters",
+            )
+
+        from botocore.exceptions import EndpointConnectionError  # type: ignore
 
         try:
             parameter = self.ssm_client.get_parameter(Name=name, WithDecryption=True)
-            return str(parameter["Parameter"]["Value"])
         except EndpointConnectionError:
-            logger.error(
-                "clrenv could not connect to AWS to fetch parameters. "
-                "If you're developing locally, try setting the offline environment variable (CLRENV_OFFLINE_DEV) to use placeholder values."
-            )
+            _log_ssm_connection_error()
             raise
         except self.ssm_client.exceptions.ParameterNotFound:
             logger.error(f"Could not find {name} in Parameter Store.")
             raise
+        # Parameters referenced by several values are only fetched once.
+        value = self.ssm_parameters[name] = str(parameter["Parameter"]["Value"])
+        return value
+
+    def load_ssm_client(self):
+        """Creates the ssm client if it does not exist yet."""
+        if not hasattr(self, "ssm_client"):
+            # Not all environments use ssm, delay import until it is needed. Importing
+            # boto3 is slow.
+            logger.info("Loading SSM ParameterStore for clrenv")
+            self.ssm_client = _ssm_client(os.getpid())
+
+
+def _remove_stale_cache_files(cache_dir: Path):
+    """Removes cache files which have not been written for CACHE_MAX_AGE seconds.
+
+    Every change to an environment file writes a new cache file. Old ones are only
+    removed when a cache file is written, which is rare. A removed file which was
+    still in use is written again by the next read."""
+    cutoff = time.time() - CACHE_MAX_AGE
+    for path in cache_dir.glob("*.pickle*"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+        except OSError:
+            # Removed by another process.
+            pass
+
+
+@functools.lru_cache(maxsize=8)
+def _read_clrypt_file(group: str, name: str) -> Mapping[str, Any]:
+    """Returns a decrypted clrypt file, decrypting it only once per process."""
+    # Not all environments use clrypt, delay import until it is needed.
+    logger.info("Loading clrypt for clrenv")
+    import clrypt
+
+    return clrypt.read_file_as_dict(group, name)
+
+
+@functools.lru_cache(maxsize=1)
+def _ssm_client(pid: int) -> Any:
+    """Returns an ssm client shared by all readers of the process.
+
+    Creating a client resolves credentials and is slow. The pid is only used as part
+    of the cache key, clients are not fork safe so a forked process creates its own."""
+    import boto3
+
+    return boto3.client("ssm")
+
+
+@functools.lru_cache(maxsize=1024)
+def _expanduser(path: str, home: Optional[str]) -> str:
+    """Memoized os.path.expanduser. home is only used as part of the cache key.
 
+    ~user paths look up the password database which is relatively slow."""
+    return os.path.expanduser(path)
 
-def safe_load(str_content: str):
+
+def _dotted(parent_keys: Tuple[str, ...], key: Any) -> str:
+    """Returns the dotted name of a key, for error messages."""
+    return ".".join((*parent_keys, str(key)))
+
+
+def _log_ssm_connection_error():
+    logger.error(
+        "clrenv could not connect to AWS to fetch parameters. "
+        "If you're developing locally, try setting the offline environment variable (CLRENV_OFFLINE_DEV) to use placeholder values."
+    )
+
+
+def safe_load(stream: Union[str, bytes, IO[str], IO[bytes]]):
     """Safely load YAML, doing so quickly with C bindings if available.
 
     By default, `yaml.safe_load()` uses the (slower) Python bindings.
     This method is a stand-in replacement that can be considerably faster.
+
+    Accepts either a string, bytes or an open file. Passing a file opened in binary
+    mode lets libyaml read and decode it directly instead of first materializing its
+    full content as a str.
+    """
+    # Constructing the loader directly skips the indirection of yaml.load().
+    loader = _safe_loader()(stream)
+    try:
+        return loader.get_single_data()
+    finally:
+        loader.dispose()
+
+
+@functools.lru_cache(maxsize=None)
+def _safe_loader() -> Any:
+    """Returns the fastest available safe yaml Loader class.
+
+    Importing yaml is delayed until a file is read to keep `import clrenv` light."""
+    try:
+        # If available, use the C bindings for far, far faster loading
+        # See: https://pyyaml.org/wiki/PyYAMLDocumentation
+        from yaml import CSafeLoader as SafeLoader
+    except ImportError:
+        # If the C bindings aren't available, fall back to the "much slower" Python
+        # bindings
+        from yaml import SafeLoader  # type: ignore
+
+        # Make a missing libyaml visible, e.g. in CI containers.
+        logger.warning(
+            "PyYAML was built without libyaml, clrenv will parse yaml slowly."
+        )
+    return SafeLoader
+
+
+def clear_cache():
+    """Clears cached parsed files, expanded user paths, clrypt files and the ssm
+    client.
+
+    Environment files are parsed again when they change. Clearing is only needed to
+    release memory, to pick up changed clrypt files or when an environment file is
+    rewritten without changing its modification time or size."""
+    _parse_file.cache_clear()
+    _expanduser.cache_clear()
+    _read_clrypt_file.cache_clear()
+    _ssm_client.cache_clear()
+
+
+def load_file(path: Path) -> Any:
+    """Returns the parsed content of a yaml file.
+
+    Files are only parsed once for as long as they are unchanged on disk. A copy of the
+    cached content is returned so callers are free to mutate it.
+    """
+    return copy_containers(_load_file_shared(path))
+
+
+def _load_file_shared(path: Path) -> Any:
+    """Returns the cached parsed content of a yaml file. It is shared and read only,
+    see _freeze."""
+    stat = path.stat()
+    return _parse_file(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _freeze(value: Any) -> Any:
+    """Returns a read only version of parsed yaml.
+
+    Dicts are wrapped in MappingProxyTypes and lists are converted to tuples so that
+    cached parses can be shared without being copied. copy_containers reverses this.
     """
-    return yaml.load(str_content, Loader=SafeLoader)
+    if type(value) is dict:
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if type(value) is list:
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+@functools.lru_cache(maxsize=128)
+def _parse_file(path: str, mtime_ns: int, size: int) -> Any:
+    """Parses a yaml file. The modification time and size are only used as part of the
+    cache key.
+
+    Files with a .json extension are parsed with a JSON parser which is much faster.
+    Other files are always parsed as yaml, even if their content looks like JSON, since
+    yaml and JSON type some values differently (e.g. 1e5)."""
+    with open(path, "rb") as config_file:
+        content = config_file.read()
+    # Empty files parse to None, like they do with yaml.
+    if not content.strip():
+        return None
+    if path.endswith(".json"):
+        return _freeze(_json_loads()(content))
+    return _freeze(safe_load(content))
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version() -> str:
+    """Returns a key which changes whenever the clrenv code may have."""
+    try:
+        # Only available in python 3.8+.
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        package_version = "unknown"
+    else:
+        try:
+            package_version = version("clrenv")
+        except PackageNotFoundError:
+            package_version = "unknown"
+    # Source checkouts have no or a stale installed version, edits to them are noticed
+    # by the modification time of the code.
+    return f"{package_version}:{os.stat(__file__).st_mtime_ns}"
+
+
+@functools.lru_cache(maxsize=None)
+def _json_loads() -> Callable[[bytes], Any]:
+    """Returns the fastest available json parsing function."""
+    try:
+        # orjson is optional and much faster than the standard library.
+        import orjson  # type: ignore
+
+        return orjson.loads
+    except ImportError:
+        import json
+
+        return json.loads
 
 
 def read_mapping_section():
@@ -175,7 +550,7 @@ def read_mapping_section():
     This contains key names which should be turned into true enviroment
     variables.
 
-    # TODO(michael.cusack): Refactor this so we don't need to read the yaml
-    twice.
+    The file is only parsed once, it is shared with EnvReader.read. Only the mapping
+    section is copied.
     """
-    return safe_load(environment_paths()[-1].read_text())["mapping"]
+    return copy_containers(_load_file_shared(environment_paths()[-1])["mapping"])
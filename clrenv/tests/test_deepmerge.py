@@ -27,3 +27,20 @@ def test_empty_nested_src():
     src = {"a": {"b": 1, "c": 1}}
     deepmerge(dst, src)
     assert dst == {"a": {"b": 1, "c": 1}}
+
+
+def test_nested_overlap():
+    dst = {"a": {"b": {"c": 1, "d": 1}, "e": 1}, "f": 1}
+    src = {"a": {"b": {"c": 2}, "g": 2}, "f": {"h": 2}}
+    deepmerge(dst, src)
+    assert dst == {"a": {"b": {"c": 2, "d": 1}, "e": 1, "g": 2}, "f": {"h": 2}}
+
+
+def test_copies_src():
+    src = {"a": {"b": [1, 2]}, "c": ({"d": 1},)}
+    dst = {}
+    deepmerge(dst, src)
+    assert dst == {"a": {"b": [1, 2]}, "c": [{"d": 1}]}
+    dst["a"]["b"].append(3)
+    dst["c"][0]["d"] = 2
+    assert src == {"a": {"b": [1, 2]}, "c": ({"d": 1},)}
@@ -13,6 +13,11 @@ def clear_mode(monkeypatch):
     monkeypatch.setenv("CLRENV_MODE", "")
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    clrenv.read.clear_cache()
+
+
 @pytest.fixture()
 def default_env(tmp_path):
     env_path = tmp_path / "env"
@@ -32,6 +37,32 @@ def test_make_env_var_name():
     assert fn(("a", "b"), as_prefix=True) == "CLRENV__A__B__"
 
 
+def test_env_var_prefix(default_env):
+    assert default_env._env_var_prefix == default_env._make_env_var_name(as_prefix=True)
+    assert default_env.aa._env_var_prefix == "CLRENV__AA__"
+    assert default_env._make_env_var_name() == "CLRENV"
+    assert default_env.aa._make_env_var_name() == "CLRENV__AA"
+
+
+def test_flatten():
+    env = {"a": "b", "aa": {"bb": "cc", "dd": {}}}
+    flat, subtrees = clrenv.evaluate.flatten(env)
+    assert flat == {("a",): "b", ("aa", "bb"): "cc"}
+    assert subtrees == {(): env, ("aa",): env["aa"], ("aa", "dd"): {}}
+
+
+def test_index_env_vars():
+    snapshot = clrenv.evaluate.snapshot_env_vars(
+        {"PATH": "", "CLRENV__A": "", "CLRENV__B__C": "", "CLRENV__B__D__E": ""}
+    )
+    index = clrenv.evaluate.index_env_vars(snapshot)
+    assert index == {
+        "CLRENV__": {"a", "b"},
+        "CLRENV__B__": {"c", "d"},
+        "CLRENV__B__D__": {"e"},
+    }
+
+
 def test_base(default_env):
     assert default_env.a == "b"
     assert default_env.aa.bb == "cc"
@@ -79,6 +110,88 @@ def test_nested(tmp_path):
     assert env.a.b.c.d.e == "f"
 
 
+def test_empty_env_read_once(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {}}))
+    env = clrenv.evaluate.RootClrEnv([env_path])
+
+    reads = []
+    read = clrenv.read.EnvReader.read
+
+    def counting_read(self):
+        reads.append(self)
+        return read(self)
+
+    monkeypatch.setattr(clrenv.read.EnvReader, "read", counting_read)
+    assert "a" not in env
+    assert "a" not in env
+    assert len(reads) == 1
+
+
+def test_interned_key_paths(default_env):
+    assert default_env.aa._key_path is default_env.aa._key_path
+    assert default_env.aa._sub_key_path("bb") is default_env._intern(("aa", "bb"))
+
+
+def test_unknown_keys_not_interned(default_env):
+    aa = default_env.aa
+    # Error messages format the node, which caches the paths of its known keys.
+    assert not hasattr(aa, "missing")
+    interned = dict(default_env._interned_key_paths)
+    child_key_paths = dict(aa._child_key_paths)
+    for i in range(10):
+        assert not hasattr(aa, f"missing{i}")
+        assert f"missing{i}" not in aa
+        assert aa.get(f"missing{i}") is None
+    assert default_env._interned_key_paths == interned
+    assert aa._child_key_paths == child_key_paths
+
+
+def test_slots(default_env):
+    assert not hasattr(default_env, "__dict__")
+    assert not hasattr(default_env.aa, "__dict__")
+
+
+def test_cached_children(default_env):
+    aa = default_env.aa
+    assert default_env.aa is aa
+
+    # Overriding a node still takes priority over the cached child.
+    default_env.set_runtime_override("aa", "x")
+    assert default_env.aa == "x"
+    default_env.clear_runtime_overrides()
+    assert default_env.aa is aa
+    assert default_env.aa.bb == "cc"
+
+
+def test_reload(tmp_path):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"a": {"b": "c"}}}))
+    env = clrenv.evaluate.RootClrEnv([env_path])
+    assert env.a.b == "c"
+
+    env_path.write_text(yaml.dump({"base": {"a": {"b": "changed", "d": "e"}}}))
+    assert env.a.b == "c"
+    env.reload()
+    assert env.a.b == "changed"
+    assert set(env.a) == {"b", "d"}
+
+
+def test_reload_finds_new_overlay(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"a": "b"}}))
+    overlay_path = tmp_path / "overlay"
+    monkeypatch.setenv("CLRENV_PATH", str(env_path))
+    monkeypatch.setenv("CLRENV_OVERLAY_PATH", str(overlay_path))
+    clrenv.path.clear_cache()
+    env = clrenv.evaluate.RootClrEnv()
+    assert env.a == "b"
+
+    overlay_path.write_text(yaml.dump({"base": {"a": "overlay"}}))
+    env.reload()
+    assert env.a == "overlay"
+
+
 def test_keyerror(default_env):
     with pytest.raises(KeyError):
         default_env["b"]  # pylint: disable=W0104
@@ -102,6 +215,15 @@ def test_runtime_override_empty_path(default_env):
         default_env.set_runtime_override([], "aaa")
 
 
+def test_runtime_override_unknown_key(default_env):
+    with pytest.raises(AssertionError):
+        default_env.set_runtime_override("z", "aaa")
+    with pytest.raises(AssertionError):
+        default_env.set_runtime_override("a.z", "aaa")
+    with pytest.raises(AssertionError):
+        default_env.set_runtime_override("aa.z", "aaa")
+
+
 def test_runtime_override_nonprimitive(default_env):
     with pytest.raises(ValueError):
         default_env.set_runtime_override("a", [])
@@ -154,6 +276,30 @@ def test_runtime_override_as_items(default_env):
     assert default_env.aa.bb == "cc"
 
 
+def test_contains(default_env):
+    assert "a" in default_env
+    assert "aa" in default_env
+    assert "bb" in default_env.aa
+    assert "bb" not in default_env
+    assert "_env" not in default_env
+    assert 1 not in default_env
+
+
+def test_contains_env_var_case(monkeypatch, default_env):
+    monkeypatch.setenv("CLRENV__FOO", "1")
+    monkeypatch.setenv("CLRENV__AA__BAR", "2")
+    default_env.refresh_env_vars()
+    for key, node in (
+        ("FOO", default_env),
+        ("Foo", default_env),
+        ("BAR", default_env.aa),
+    ):
+        assert node[key]
+        assert key in node
+    assert "FOO" in default_env and "foo" in default_env
+    assert "A" not in default_env
+
+
 def test_env_var(monkeypatch, default_env):
     # Known attribute
     monkeypatch.setenv("CLRENV__A", "z")
@@ -162,6 +308,7 @@ def test_env_var(monkeypatch, default_env):
     # New attribute
     assert "z" not in default_env
     monkeypatch.setenv("CLRENV__Z", "z")
+    default_env.refresh_env_vars()
     assert "z" in default_env
     assert "z" in list(default_env)
     assert default_env.z == "z"
@@ -169,6 +316,7 @@ def test_env_var(monkeypatch, default_env):
     # Deeply set
     assert "y" not in default_env
     monkeypatch.setenv("CLRENV__Y__YY__YYY", "yyyy")
+    default_env.refresh_env_vars()
     assert default_env.y.yy.yyy == "yyyy"
     assert "y" in default_env
 
@@ -179,6 +327,32 @@ def test_env_var(monkeypatch, default_env):
     assert default_env.z == "z"
 
 
+def test_env_var_snapshot(monkeypatch, default_env):
+    monkeypatch.setenv("CLRENV__A", "z")
+    assert default_env.a == "z"
+
+    # Changing the value of an existing env var requires a refresh.
+    monkeypatch.setenv("CLRENV__A", "y")
+    assert default_env.a == "z"
+    default_env.refresh_env_vars()
+    assert default_env.a == "y"
+
+    # Replacing one env var with another, keeping the number of env vars, also
+    # requires a refresh.
+    monkeypatch.delenv("CLRENV__A")
+    monkeypatch.setenv("CLRENV__B", "x")
+    assert default_env.a == "y"
+    assert "a" in default_env and "b" not in default_env
+    default_env.refresh_env_vars()
+    assert default_env.a == "b"
+    assert default_env.b == "x"
+
+    # Reloading also snapshots the env vars again.
+    monkeypatch.delenv("CLRENV__B")
+    default_env.reload()
+    assert "b" not in default_env
+
+
 def test_underscored_keys(default_env):
     with pytest.raises(KeyError):
         default_env["__env"]  # pylint: disable=pointless-statement
@@ -236,6 +410,17 @@ def test_ssm_secret(tmp_path, monkeypatch):
                     error_response={}, operation_name=""
                 )
 
+        def get_parameters(self, Names=None, WithDecryption=None):
+            assert WithDecryption is True
+            if "endpoint_error" in Names:
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url="url")
+            return {
+                "Parameters": [
+                    {"Name": name, "Value": "bbb"} for name in Names if name == "aaa"
+                ],
+                "InvalidParameters": [name for name in Names if name != "aaa"],
+            }
+
     def mock_client(name):
         assert name == "ssm"
         return MockClient()
@@ -6,6 +6,7 @@ import clrenv
 @pytest.fixture(autouse=True)
 def clear_overlay_path(monkeypatch):
     monkeypatch.setenv("CLRENV_OVERLAY_PATH", "")
+    clrenv.path.clear_cache()
 
 
 def test_custom_base(tmp_path, monkeypatch):
@@ -38,3 +39,52 @@ def test_overlay(tmp_path, monkeypatch):
         overlay_path2,
         env_path,
     )
+
+
+def test_cached(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text("")
+    monkeypatch.setenv("CLRENV_PATH", str(env_path))
+    assert clrenv.path.environment_paths() == (env_path,)
+
+    overlay_path = tmp_path / "overlay"
+    monkeypatch.setenv("CLRENV_OVERLAY_PATH", str(overlay_path))
+    assert clrenv.path.environment_paths() == (env_path,)
+
+    # Not noticed until the cache is cleared.
+    overlay_path.write_text("")
+    assert clrenv.path.environment_paths() == (env_path,)
+    clrenv.path.clear_cache()
+    assert clrenv.path.environment_paths() == (overlay_path, env_path)
+
+
+def test_find_in_parents(tmp_path, monkeypatch):
+    env_path = tmp_path / "environment.yaml"
+    env_path.write_text("")
+    cwd = tmp_path / "a/b"
+    cwd.mkdir(parents=True)
+    monkeypatch.delenv("CLRENV_PATH", raising=False)
+    monkeypatch.chdir(cwd)
+    assert clrenv.path.environment_paths() == (env_path,)
+
+    # The walk is cached per cwd, changing other env vars does not repeat it.
+    monkeypatch.setenv("CLRENV_OVERLAY_PATH", str(tmp_path / "missing"))
+    assert clrenv.path.environment_paths() == (env_path,)
+    assert clrenv.path._find_in_cwd_or_parents.cache_info().hits == 1
+
+
+def test_cached_deleted(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text("")
+    overlay_path = tmp_path / "overlay"
+    overlay_path.write_text("")
+    monkeypatch.setenv("CLRENV_PATH", str(env_path))
+    monkeypatch.setenv("CLRENV_OVERLAY_PATH", str(overlay_path))
+    assert clrenv.path.environment_paths() == (overlay_path, env_path)
+
+    overlay_path.unlink()
+    assert clrenv.path.environment_paths() == (env_path,)
+
+    env_path.unlink()
+    with pytest.raises(ValueError):
+        clrenv.path.environment_paths()
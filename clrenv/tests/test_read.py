@@ -1,3 +1,7 @@
+import os
+import pickle
+import subprocess
+import sys
 from pathlib import Path
 from types import SimpleNamespace
 
@@ -14,6 +18,11 @@ def clear_mode(monkeypatch):
     monkeypatch.setenv("CLRENV_MODE", "")
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    clrenv.read.clear_cache()
+
+
 def test_empty_file(tmp_path):
     env_path = tmp_path / "env"
     env_path.write_text(yaml.dump({"base": {"foo": "bar"}}))
@@ -25,6 +34,18 @@ def test_empty_file(tmp_path):
     assert env["foo"] == "bar"
 
 
+def test_merge_order(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLRENV_MODE", "mode")
+    paths = [tmp_path / f"env{i}" for i in range(3)]
+    for i, path in enumerate(paths):
+        path.write_text(
+            yaml.dump({"base": {"a": i, f"b{i}": i}, "mode": {"c": i, f"d{i}": i}})
+        )
+
+    env = clrenv.read.EnvReader(paths).read()
+    assert env == {"a": 0, "b0": 0, "b1": 1, "b2": 2, "c": 0, "d0": 0, "d1": 1, "d2": 2}
+
+
 def test_int_key(tmp_path):
     env_path = tmp_path / "env"
     env_path.write_text(yaml.dump({"base": {"foo": "bar", 2: "bazz"}}))
@@ -33,6 +54,35 @@ def test_int_key(tmp_path):
         clrenv.read.EnvReader([env_path]).read()
 
 
+def test_utf8_file(tmp_path):
+    env_path = tmp_path / "env"
+    env_path.write_text('base:\n  foo: "b\u00e4r"\n', encoding="utf-8")
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env["foo"] == "b\u00e4r"
+
+
+def test_json_file(tmp_path):
+    env_path = tmp_path / "env.json"
+    env_path.write_text('{"base": {"foo": "bar", "baz": [1, 2.5, true]}}')
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env == {"foo": "bar", "baz": [1, 2.5, True]}
+
+
+def test_json_content_in_yaml_file(tmp_path):
+    # Only .json files are parsed as JSON, yaml types some values differently.
+    env_path = tmp_path / "env"
+    env_path.write_text('{"base": {"foo": 1e5}}')
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env == {"foo": "1e5"}
+
+
+def test_unknown_tag(tmp_path):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "^unknown aaa", "bar": "^keyfile"}}))
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env == {"foo": "^unknown aaa", "bar": "^keyfile"}
+
+
 def test_underscore_key(tmp_path):
     env_path = tmp_path / "env"
     env_path.write_text(yaml.dump({"base": {"foo": "bar", "_foo": "bazz"}}))
@@ -41,6 +91,14 @@ def test_underscore_key(tmp_path):
         clrenv.read.EnvReader([env_path]).read()
 
 
+def test_nested_non_primitive_value(tmp_path):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": {"bar": {"baz": {1, 2}}}}}))
+
+    with pytest.raises(ValueError, match="foo.bar.baz"):
+        clrenv.read.EnvReader([env_path]).read()
+
+
 def test_expands_user(tmp_path):
     env_path = tmp_path / "env"
     env_path.write_text(yaml.dump({"base": {"foo": "~/aaa"}}))
@@ -48,6 +106,15 @@ def test_expands_user(tmp_path):
     assert env["foo"] == Path("~/aaa").expanduser().as_posix()
 
 
+def test_expands_user_home_changed(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "~/aaa"}}))
+    monkeypatch.setenv("HOME", "/home/first")
+    assert clrenv.read.EnvReader([env_path]).read()["foo"] == "/home/first/aaa"
+    monkeypatch.setenv("HOME", "/home/second")
+    assert clrenv.read.EnvReader([env_path]).read()["foo"] == "/home/second/aaa"
+
+
 def test_none_values_to_empty_str(tmp_path):
     env_path = tmp_path / "env"
     env_path.write_text(yaml.dump({"base": {"foo": None}}))
@@ -100,6 +167,17 @@ def test_ssm(tmp_path, monkeypatch):
                     error_response={}, operation_name=""
                 )
 
+        def get_parameters(self, Names=None, WithDecryption=None):
+            assert WithDecryption is True
+            if "endpoint_error" in Names:
+                raise botocore.exceptions.EndpointConnectionError(endpoint_url="url")
+            return {
+                "Parameters": [
+                    {"Name": name, "Value": "bbb"} for name in Names if name == "aaa"
+                ],
+                "InvalidParameters": [name for name in Names if name != "aaa"],
+            }
+
     def mock_client(name):
         assert name == "ssm"
         return MockClient()
@@ -121,6 +199,123 @@ def test_ssm(tmp_path, monkeypatch):
         env = clrenv.read.EnvReader([env_path]).read()
 
 
+def test_ssm_batched(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLRENV_OFFLINE_DEV", "")
+    import boto3
+
+    batches = []
+
+    class MockClient:
+        def get_parameters(self, Names=None, WithDecryption=None):
+            batches.append(Names)
+            return {
+                "Parameters": [{"Name": name, "Value": name.upper()} for name in Names],
+                "InvalidParameters": [],
+            }
+
+    monkeypatch.setattr(boto3, "client", lambda name: MockClient())
+
+    env_path = tmp_path / "env"
+    values = {f"foo{i}": f"^parameter p{i}" for i in range(12)}
+    values["bar"] = "^parameter p0"
+    env_path.write_text(yaml.dump({"base": values}))
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env["foo11"].value == "P11"
+    assert env["bar"].value == "P0"
+    assert [len(batch) for batch in batches] == [10, 2]
+
+
+def test_ssm_batched_invalid(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLRENV_OFFLINE_DEV", "")
+    import boto3
+
+    class MockClient:
+        exceptions = SimpleNamespace(ParameterNotFound=botocore.exceptions.ClientError)
+
+        def get_parameters(self, Names=None, WithDecryption=None):
+            return {"Parameters": [], "InvalidParameters": Names}
+
+        def get_parameter(self, Name=None, WithDecryption=None):
+            raise AssertionError("Invalid parameters should not be fetched again.")
+
+    monkeypatch.setattr(boto3, "client", lambda name: MockClient())
+
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "^parameter missing"}}))
+    with pytest.raises(botocore.exceptions.ClientError, match="missing"):
+        clrenv.read.EnvReader([env_path]).read()
+
+
+def test_ssm_batched_selector(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLRENV_OFFLINE_DEV", "")
+    import boto3
+
+    class MockClient:
+        def get_parameters(self, Names=None, WithDecryption=None):
+            # Like ssm, the selector is split off from the returned name.
+            parameters = []
+            for requested in Names:
+                name, _, version = requested.partition(":")
+                parameter = {"Name": name, "Value": f"{name}@{version or 'latest'}"}
+                if version:
+                    parameter["Selector"] = f":{version}"
+                parameters.append(parameter)
+            return {"Parameters": parameters, "InvalidParameters": []}
+
+        def get_parameter(self, Name=None, WithDecryption=None):
+            raise AssertionError("Batched parameters should not be fetched again.")
+
+    monkeypatch.setattr(boto3, "client", lambda name: MockClient())
+
+    env_path = tmp_path / "env"
+    values = {"foo": "^parameter /x", "bar": "^parameter /x:1"}
+    env_path.write_text(yaml.dump({"base": values}))
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env["foo"].value == "/x@latest"
+    assert env["bar"].value == "/x@1"
+
+
+def test_ssm_batched_access_denied(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLRENV_OFFLINE_DEV", "")
+    import boto3
+
+    class MockClient:
+        def get_parameters(self, Names=None, WithDecryption=None):
+            raise botocore.exceptions.ClientError(
+                error_response={"Error": {"Code": "AccessDeniedException"}},
+                operation_name="GetParameters",
+            )
+
+        def get_parameter(self, Name=None, WithDecryption=None):
+            return {"Parameter": {"Value": Name.upper()}}
+
+    monkeypatch.setattr(boto3, "client", lambda name: MockClient())
+
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "^parameter aaa"}}))
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env["foo"].value == "AAA"
+
+
+def test_ssm_parameter_memoized(monkeypatch):
+    monkeypatch.setenv("CLRENV_OFFLINE_DEV", "")
+    import boto3
+
+    names = []
+
+    class MockClient:
+        def get_parameter(self, Name=None, WithDecryption=None):
+            names.append(Name)
+            return {"Parameter": {"Value": "bbb"}}
+
+    monkeypatch.setattr(boto3, "client", lambda name: MockClient())
+
+    reader = clrenv.read.EnvReader([])
+    assert reader.evaluate_ssm_parameter("aaa") == "bbb"
+    assert reader.evaluate_ssm_parameter("aaa") == "bbb"
+    assert names == ["aaa"]
+
+
 def test_offline_parameter_flag(tmp_path, monkeypatch):
     monkeypatch.setenv("CLRENV_OFFLINE_DEV", "true")
 
@@ -129,3 +324,161 @@ def test_offline_parameter_flag(tmp_path, monkeypatch):
     env = clrenv.read.EnvReader([env_path]).read()
     assert isinstance(env["foo"], Secret)
     assert env["foo"].value == "CLRENV_OFFLINE_PLACEHOLDER"
+
+
+def test_load_file_cached(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "bar"}}))
+    assert clrenv.read.load_file(env_path) == {"base": {"foo": "bar"}}
+
+    # Returned values are copies and can be mutated.
+    clrenv.read.load_file(env_path)["base"]["foo"] = "baz"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("File should not be parsed again.")
+
+    with monkeypatch.context() as m:
+        m.setattr(clrenv.read, "safe_load", fail)
+        assert clrenv.read.load_file(env_path) == {"base": {"foo": "bar"}}
+
+    # Changed files are parsed again.
+    env_path.write_text(yaml.dump({"base": {"foo": "changed"}}))
+    assert clrenv.read.load_file(env_path) == {"base": {"foo": "changed"}}
+
+
+def test_cached_parse_read_only(tmp_path):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": ["bar"]}}))
+    cached = clrenv.read._load_file_shared(env_path)
+    with pytest.raises(TypeError):
+        cached["base"]["foo"] = "baz"  # type: ignore
+    assert cached["base"]["foo"] == ("bar",)
+
+    env = clrenv.read.EnvReader([env_path]).read()
+    assert env == {"foo": ["bar"]}
+    assert type(env["foo"]) is list
+
+
+def test_read_mapping_section_shares_parse(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "~/bar"}, "mapping": {"a": "b"}}))
+    monkeypatch.setenv("CLRENV_PATH", str(env_path))
+    monkeypatch.setenv("CLRENV_OVERLAY_PATH", "")
+    clrenv.path.clear_cache()
+    env = clrenv.read.EnvReader([env_path]).read()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("File should not be parsed again.")
+
+    monkeypatch.setattr(clrenv.read, "safe_load", fail)
+    assert clrenv.read.read_mapping_section() == {"a": "b"}
+    # Post processing did not modify the cached parse.
+    assert clrenv.read.EnvReader([env_path]).read() == env
+
+
+def test_boto3_imported_lazily():
+    # Run in a new interpreter since the tests themselves import boto3.
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, clrenv; assert 'boto3' not in sys.modules",
+        ],
+        check=True,
+    )
+
+
+def test_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLRENV_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("VAR_FOR_CLRENV_TEST", "bar")
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "$VAR_FOR_CLRENV_TEST"}}))
+    assert clrenv.read.EnvReader([env_path]).read() == {"foo": "bar"}
+    assert len(list((tmp_path / "cache").iterdir())) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("File should not be read again.")
+
+    with monkeypatch.context() as m:
+        m.setattr(clrenv.read, "_load_file_shared", fail)
+        # Values are post processed again.
+        m.setenv("VAR_FOR_CLRENV_TEST", "baz")
+        assert clrenv.read.EnvReader([env_path]).read() == {"foo": "baz"}
+
+    # Changed files are read again.
+    env_path.write_text(yaml.dump({"base": {"foo": "changed"}}))
+    assert clrenv.read.EnvReader([env_path]).read() == {"foo": "changed"}
+
+
+def test_cache_dir_write_error(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("CLRENV_CACHE_DIR", str(cache_dir))
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "bar"}}))
+
+    def fail(*args, **kwargs):
+        raise pickle.PicklingError()
+
+    monkeypatch.setattr(pickle, "dump", fail)
+    assert clrenv.read.EnvReader([env_path]).read() == {"foo": "bar"}
+    assert list(cache_dir.iterdir()) == []
+
+
+def test_cache_dir_stale(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("CLRENV_CACHE_DIR", str(cache_dir))
+    cache_dir.mkdir()
+    stale_path = cache_dir / "stale.pickle"
+    stale_path.write_bytes(b"")
+    os.utime(stale_path, (0, 0))
+    recent_path = cache_dir / "recent.pickle"
+    recent_path.write_bytes(b"")
+
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "bar"}}))
+    clrenv.read.EnvReader([env_path]).read()
+    assert not stale_path.exists()
+    assert recent_path.exists()
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_fingerprint_version(tmp_path, monkeypatch):
+    env_path = tmp_path / "env"
+    env_path.write_text(yaml.dump({"base": {"foo": "bar"}}))
+    reader = clrenv.read.EnvReader([env_path])
+    fingerprint = reader.fingerprint()
+    monkeypatch.setattr(clrenv.read, "_code_version", lambda: "0.0.0:0")
+    assert reader.fingerprint() != fingerprint
+
+
+def test_safe_loader_fallback(monkeypatch, caplog):
+    monkeypatch.delattr(yaml, "CSafeLoader", raising=False)
+    clrenv.read._safe_loader.cache_clear()
+    try:
+        assert clrenv.read._safe_loader() is yaml.SafeLoader
+        assert "without libyaml" in caplog.text
+    finally:
+        clrenv.read._safe_loader.cache_clear()
+
+
+def test_ssm_client_shared(monkeypatch):
+    import boto3
+
+    clients = []
+    monkeypatch.setattr(boto3, "client", lambda name: clients.append(name) or name)
+
+    clrenv.read.EnvReader([]).load_ssm_client()
+    clrenv.read.EnvReader([]).load_ssm_client()
+    assert clients == ["ssm"]
+
+
+def test_secret():
+    secret = Secret(source="^keyfile aaa", value="bbb")
+    assert secret.value == "bbb"
+    assert secret == Secret(source="^keyfile aaa", value="bbb")
+    assert secret != Secret(source="^keyfile aaa", value="ccc")
+    assert hash(secret) == hash(Secret(source="^keyfile aaa", value="bbb"))
+    assert "bbb" not in repr(secret)
+    # Secret is a NamedTuple, which is part of its api.
+    assert tuple(secret) == ("^keyfile aaa", "bbb")
+    assert not hasattr(secret, "__dict__")
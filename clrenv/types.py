@@ -29,14 +29,23 @@ NestedMapping = Mapping[str, Union[LeafValue, Mapping[str, Any]]]
 MutableNestedMapping = MutableMapping[str, Union[LeafValue, MutableMapping[str, Any]]]
 
 PRIMITIVE_TYPES = (bool, int, float, str)
+_PRIMITIVE_TYPE_SET = frozenset(PRIMITIVE_TYPES)
 
 
 def check_valid_leaf_value(key: Any, value: Any) -> None:
     """Raises a ValueError is the value is not a valid type.
 
     key is only used for the error message."""
-    if isinstance(value, PRIMITIVE_TYPES):
-        return
-    if isinstance(value, list) and all(isinstance(_, PRIMITIVE_TYPES) for _ in value):
+    # Exact type checks are cheaper than isinstance, fall back to it for subclasses.
+    value_type = type(value)
+    if value_type in _PRIMITIVE_TYPE_SET or isinstance(value, PRIMITIVE_TYPES):
         return
+    if value_type is list or isinstance(value, list):
+        for item in value:
+            if type(item) not in _PRIMITIVE_TYPE_SET and not isinstance(
+                item, PRIMITIVE_TYPES
+            ):
+                break
+        else:
+            return
     raise ValueError(f"Non primitive value type: {key}={value}")